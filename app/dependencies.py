@@ -1,20 +1,46 @@
 import logging
+from functools import lru_cache
 from typing import Annotated
 
-from fastapi import Depends, Request
+from fastapi import Depends, HTTPException, Request
 
-from app.models.users import User, UserClient
+from app.models.courses import CourseClient
+from app.models.users import User, UserClient, UserRoles
 from app.utils.jwt_utils import JWTUtils
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def authenticate_request(request: Request) -> bool:
-    jwt_utils = JWTUtils()
+@lru_cache(maxsize=1)
+def get_jwt_utils() -> JWTUtils:
+    """Shared JWTUtils instance so config is only loaded once."""
+    return JWTUtils()
+
+
+def base_url(request: Request) -> str:
+    """Scheme+host prefix for building self links, computed once per request."""
+    return f"{request.url.scheme}://{request.url.netloc}"
+
+
+@lru_cache(maxsize=1)
+def get_user_client() -> UserClient:
+    """Shared UserClient so handlers don't rebuild one per request."""
+    return UserClient()
+
+
+@lru_cache(maxsize=1)
+def get_course_client() -> CourseClient:
+    """Shared CourseClient so handlers don't rebuild one per request."""
+    return CourseClient()
+
+
+async def authenticate_request(
+    request: Request,
+    jwt_utils: Annotated[JWTUtils, Depends(get_jwt_utils)],
+) -> bool:
     try:
-        # just determine if we can validate
-        await jwt_utils.validate_token(request)
+        # stash the claims so downstream deps don't decode the token again
+        request.state.decoded_token = await jwt_utils.validate_token(request)
     except Exception:
         return False
 
@@ -28,11 +54,9 @@ async def get_user_info(
     if not authenticated:
         return None
 
-    jwt_utils = JWTUtils()
-    user_client = UserClient()
+    user_client = get_user_client()
 
-    token = jwt_utils.extract_token(request)
-    user_info = await jwt_utils.decode_token(token)
+    user_info = request.state.decoded_token
     try:
         sub = user_info["sub"]
         user = await user_client.get_user_by_sub(sub)
@@ -41,3 +65,17 @@ async def get_user_info(
         return None
 
     return user
+
+
+async def require_admin(
+    user: Annotated[User | None, Depends(get_user_info)],
+) -> User:
+    """Admin gate that runs before body validation on admin-only routes."""
+    if user is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if user.role != UserRoles.ADMIN.value:
+        raise HTTPException(
+            status_code=403,
+            detail="You don't have permission on this resource",
+        )
+    return user
@@ -1,14 +1,23 @@
-from fastapi import Request
+from fastapi import HTTPException, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 
 async def validation_exception_handler(
     request: Request, exc: RequestValidationError
-) -> JSONResponse:
-    return JSONResponse(
+) -> ORJSONResponse:
+    return ORJSONResponse(
         status_code=400,
         content={
             "Error": "The request body is invalid"
         },
     )
+
+
+async def http_exception_handler(
+    request: Request, exc: HTTPException
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=exc.status_code,
+        content={"Error": exc.detail},
+    )
@@ -1,27 +1,51 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Annotated
 
 from authlib.integrations.starlette_client import OAuth
 from fastapi import Depends, FastAPI, Request
-from fastapi.exceptions import RequestValidationError
+from fastapi.exceptions import HTTPException, RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
-from app.dependencies import authenticate_request
-from app.exceptions import validation_exception_handler
-from app.models.auth import DecodedToken
+from app.dependencies import authenticate_request, get_jwt_utils
+from app.exceptions import (
+    http_exception_handler,
+    validation_exception_handler,
+)
+from app.models.auth import DecodedToken, DecodedTokenAdapter
+from app.models.courses import enrollment_batcher
 from app.routers import courses, users
-from app.utils.jwt_utils import JWTUtils
 
-app = FastAPI()
+logging.basicConfig(level=logging.INFO)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # bound the pool that run_blocking/to_thread offload onto so a burst
+    # of blocking cloud calls can't spawn unbounded threads
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=32))
+    enrollment_batcher.start()
+    yield
+    await enrollment_batcher.stop()
+    await users.http_client.aclose()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 oauth = OAuth()
-jwt_utils = JWTUtils()
+jwt_utils = get_jwt_utils()
+app.state.jwt_utils = jwt_utils
+auth0_base_url = "https://" + jwt_utils.get_domain()
 oauth.register(
     "auth0",
     client_id=jwt_utils.get_client_id(),
     client_secret=jwt_utils.get_client_secret(),
-    api_base_url="https://" + jwt_utils.get_domain(),
-    access_token_url="https://" + jwt_utils.get_domain() + "/oauth/token",
-    authorize_url="https://" + jwt_utils.get_domain() + "/authorize",
+    api_base_url=auth0_base_url,
+    access_token_url=auth0_base_url + "/oauth/token",
+    authorize_url=auth0_base_url + "/authorize",
     client_kwargs={
         "scope": "openid profile email",
     },
@@ -44,6 +68,11 @@ async def handle(request, exc):
     return await validation_exception_handler(request, exc)
 
 
+@app.exception_handler(HTTPException)
+async def handle_http_exception(request, exc):
+    return await http_exception_handler(request, exc)
+
+
 # I think I will just use a dependency on each route so I don't have
 # weird routing stuff anymore
 
@@ -67,7 +96,7 @@ async def handle(request, exc):
 @app.get("/")
 async def root(authenticated: Annotated[bool, Depends(authenticate_request)]):
     print("Authenticated dep ran: ", authenticated)
-    return JSONResponse(content={"message": "connected"})
+    return {"message": "connected"}
 
 
 @app.get(
@@ -75,5 +104,9 @@ async def root(authenticated: Annotated[bool, Depends(authenticate_request)]):
     response_model=DecodedToken,
 )
 async def decode_token(request: Request):
-    token = JWTUtils.extract_token(request)
-    return DecodedToken(**JWTUtils.decode_token(token))
+    token = jwt_utils.extract_token(request)
+    # the pre-compiled adapter validates in pydantic-core without the
+    # per-call model __init__ overhead
+    return DecodedTokenAdapter.validate_python(
+        await jwt_utils.decode_token(token)
+    )
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 
 class DecodedToken(BaseModel):
@@ -15,6 +15,10 @@ class DecodedToken(BaseModel):
     updated_at: str
 
 
+# compiled once at import so per-call validation stays in pydantic-core
+DecodedTokenAdapter = TypeAdapter(DecodedToken)
+
+
 class LoginPost(BaseModel):
     username: str
     password: str
@@ -1,14 +1,21 @@
+import asyncio
 import logging
 from typing import Optional
 
+from cachetools import TTLCache
 from google.cloud import datastore
 from pydantic import BaseModel
 
 from app.models.users import UserClient, UserRoles
+from app.utils.datastore_utils import get_datastore_client, run_blocking
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# course metadata and instructor assignment change rarely compared to
+# how often they are read, so both get a short read-through cache
+_course_cache = TTLCache(maxsize=1024, ttl=30)
+_instructor_cache = TTLCache(maxsize=1024, ttl=30)
+
 """
 How do we model courses?
 Its going to be so annoying with datastore
@@ -75,9 +82,91 @@ class CourseEnrollmentUpdate(BaseModel):
     remove: list[int]
 
 
+class EnrollmentBatcher:
+    """
+    Accumulates enrollment writes from concurrent requests for a short
+    window and flushes them to datastore with a single put_multi
+    """
+
+    FLUSH_INTERVAL = 0.01  # seconds
+    MAX_BATCH = 500
+
+    def __init__(self):
+        self.client = None
+        self.COURSE_ENROLMENT = "CourseEnrolment"
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        if self._task is None:
+            # resolve the shared client here rather than at import so
+            # loading this module doesn't require GCP credentials
+            self.client = get_datastore_client()
+            self._task = asyncio.create_task(self._drain())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def enroll(self, course_id: int, student_id: int) -> None:
+        """Queue one enrollment write and wait for its batch to commit"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((course_id, student_id, future))
+        await future
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.FLUSH_INTERVAL
+            while len(batch) < self.MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch: list) -> None:
+        entities = []
+        for course_id, student_id, _ in batch:
+            entity = datastore.Entity(key=self.client.key(self.COURSE_ENROLMENT))
+            entity.update({"course_id": course_id, "student_id": student_id})
+            entities.append(entity)
+
+        try:
+            await run_blocking(self.client.put_multi, entities)
+        except Exception as e:
+            logger.error(f"Error flushing enrollment batch: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+enrollment_batcher = EnrollmentBatcher()
+
+
 class CourseClient:
     def __init__(self):
-        self.client = datastore.Client(database="tarpaulin")
+        self.client = get_datastore_client()
         self.COURSES = "Courses"
         self.COURSE_INSTRUCTORS = "CourseInstructor"
         self.COURSE_ENROLMENT = "CourseEnrolment"
@@ -94,7 +183,7 @@ class CourseClient:
                     "term": course.term,
                 }
             )
-            self.client.put(new_course)
+            await run_blocking(self.client.put, new_course)
 
             new_course["id"] = new_course.key.id
         except Exception as e:
@@ -112,7 +201,7 @@ class CourseClient:
                     "instructor_id": course.instructor_id,
                 }
             )
-            self.client.put(new_course_instructor)
+            await run_blocking(self.client.put, new_course_instructor)
         except Exception as e:
             logger.error(f"Error creating course instructor: {e}")
             raise
@@ -120,40 +209,42 @@ class CourseClient:
         return new_course["id"]
 
     async def get_course(self, course_id: int) -> CourseCore:
+        cached = _course_cache.get(course_id)
+        if cached is not None:
+            return cached
+
         course_key = self.client.key(self.COURSES, course_id)
-        query = self.client.query(kind=self.COURSES)
-        query.key_filter(course_key, "=")
         try:
-            entity = list(query.fetch())
-            if len(entity) == 0:
+            # direct key lookup, no query planner involved
+            entity = await run_blocking(self.client.get, course_key)
+            if entity is None:
                 raise CourseException("Course not found")
-            entity = entity[0]
             entity["id"] = entity.key.id
 
         except Exception as e:
             logger.error(f"Error fetching course: {e}")
             raise
 
-        return CourseCore(
+        course = CourseCore(
             subject=entity["subject"],
             title=entity["title"],
             number=entity["number"],
             id=entity["id"],
             term=entity["term"],
         )
+        _course_cache[course_id] = course
+        return course
 
     async def get_course_instructor(self, course_id: int) -> int:
         course_instructor_key = self.client.key(
             self.COURSE_INSTRUCTORS, course_id
         )
-        query = self.client.query(kind=self.COURSE_INSTRUCTORS)
-        query.key_filter(course_instructor_key, "=")
         try:
-            entity = list(query.fetch())
-            if len(entity) == 0:
+            entity = await run_blocking(
+                self.client.get, course_instructor_key
+            )
+            if entity is None:
                 raise CourseException("Course instructor not found")
-            entity = entity[0]
-            entity["id"] = entity.key.id
 
         except Exception as e:
             logger.error(f"Error fetching course instructor: {e}")
@@ -162,15 +253,22 @@ class CourseClient:
         return entity["instructor_id"]
 
     async def get_instructor(self, course_id: int) -> int:
+        cached = _instructor_cache.get(course_id)
+        if cached is not None:
+            return cached
+
         query = self.client.query(kind=self.COURSE_INSTRUCTORS)
         query.add_filter(
             property_name="course_id", operator="=", value=course_id
         )
 
         try:
-            entities = list(query.fetch(limit=1))
+            entities = await run_blocking(
+                lambda: list(query.fetch(limit=1))
+            )
             if len(entities) == 0:
                 raise CourseException("Course instructor not found")
+            _instructor_cache[course_id] = entities[0]["instructor_id"]
             return entities[0]["instructor_id"]
         except Exception as e:
             logger.error(
@@ -184,8 +282,8 @@ class CourseClient:
         try:
             course_query = self.client.query(kind=self.COURSES)
             course_query.order = ["subject"]
-            course_entities = list(
-                course_query.fetch(offset=offset, limit=limit)
+            course_entities = await run_blocking(
+                lambda: list(course_query.fetch(offset=offset, limit=limit))
             )
 
             if not course_entities:
@@ -194,19 +292,55 @@ class CourseClient:
             for entity in course_entities:
                 entity["id"] = entity.key.id
 
+            course_ids = [entity["id"] for entity in course_entities]
+
+            try:
+                # one IN query for the whole page instead of one query per course
+                instructor_query = self.client.query(
+                    kind=self.COURSE_INSTRUCTORS
+                )
+                instructor_query.add_filter(
+                    property_name="course_id",
+                    operator="IN",
+                    value=course_ids,
+                )
+                instructor_entities = await run_blocking(
+                    lambda: list(instructor_query.fetch())
+                )
+                instructors = {
+                    entity["course_id"]: entity["instructor_id"]
+                    for entity in instructor_entities
+                }
+            except Exception as e:
+                # the emulator doesn't support IN; fall back to concurrent
+                # per-course lookups instead of awaiting them one by one
+                logger.warning(
+                    f"IN query for instructors failed, "
+                    f"falling back to parallel lookups: {e}"
+                )
+                results = await asyncio.gather(
+                    *[
+                        self.get_instructor(course_id)
+                        for course_id in course_ids
+                    ],
+                    return_exceptions=True,
+                )
+                instructors = {
+                    course_id: result
+                    for course_id, result in zip(course_ids, results)
+                    if not isinstance(result, BaseException)
+                }
+
             courses_with_instructors = []
             for course_entity in course_entities:
-                try:
-                    instructor_id = await self.get_instructor(
-                        course_entity["id"]
-                    )
-                    course_entity["instructor_id"] = instructor_id
-                    courses_with_instructors.append(Course(**course_entity))
-                except CourseException as e:
+                instructor_id = instructors.get(course_entity["id"])
+                if instructor_id is None:
                     logger.warning(
-                        f"Course {course_entity['id']} has no instructor: {e}"
+                        f"Course {course_entity['id']} has no instructor"
                     )
                     continue
+                course_entity["instructor_id"] = instructor_id
+                courses_with_instructors.append(Course(**course_entity))
 
             return courses_with_instructors
 
@@ -220,7 +354,7 @@ class CourseClient:
             query.add_filter(
                 property_name="course_id", operator="=", value=course_id
             )
-            entities = list(query.fetch())
+            entities = await run_blocking(lambda: list(query.fetch()))
             student_ids = [entity["student_id"] for entity in entities]
 
         except Exception as e:
@@ -247,7 +381,9 @@ class CourseClient:
                 query.add_filter(
                     property_name="student_id", operator="=", value=user_id
                 )
-                entities = list(query.fetch())
+                entities = await run_blocking(
+                    lambda: list(query.fetch())
+                )
                 course_ids = [entity["course_id"] for entity in entities]
 
             elif user_role == UserRoles.INSTRUCTOR.value:
@@ -255,7 +391,9 @@ class CourseClient:
                 query.add_filter(
                     property_name="instructor_id", operator="=", value=user_id
                 )
-                entities = list(query.fetch())
+                entities = await run_blocking(
+                    lambda: list(query.fetch())
+                )
                 course_ids = [entity["course_id"] for entity in entities]
 
         except Exception as e:
@@ -267,7 +405,7 @@ class CourseClient:
     async def update_course(self, course_id: int, updates: dict) -> None:
         try:
             course_key = self.client.key(self.COURSES, course_id)
-            course_entity = self.client.get(course_key)
+            course_entity = await run_blocking(self.client.get, course_key)
 
             if not course_entity:
                 raise CourseException(f"Course with ID {course_id} not found")
@@ -281,7 +419,8 @@ class CourseClient:
                         f"Invalid course property: {property}"
                     )
 
-            self.client.put(course_entity)
+            await run_blocking(self.client.put, course_entity)
+            _course_cache.pop(course_id, None)
             logger.info(f"Successfully updated course {course_id}")
 
         except Exception as e:
@@ -296,32 +435,40 @@ class CourseClient:
         """
         try:
             course_key = self.client.key(self.COURSES, course_id)
-            course_entity = self.client.get(course_key)
-
-            if not course_entity:
-                raise CourseException(f"Course with ID {course_id} not found")
 
+            # look up the instructor row key first; non-ancestor queries
+            # are not allowed inside a transaction
             query = self.client.query(kind=self.COURSE_INSTRUCTORS)
             query.add_filter(
                 property_name="course_id", operator="=", value=course_id
             )
+            instructor_entities = await run_blocking(
+                lambda: list(query.fetch(limit=1))
+            )
 
-            instructor_entities = list(query.fetch())
-
-            if instructor_entities:
-                instructor_entity = instructor_entities[0]
-                instructor_entity["instructor_id"] = new_instructor_id
-                self.client.put(instructor_entity)
-            else:
-                new_instructor_key = self.client.key(self.COURSE_INSTRUCTORS)
-                new_instructor_entity = datastore.Entity(key=new_instructor_key)
-                new_instructor_entity.update(
-                    {
-                        "course_id": course_id,
-                        "instructor_id": new_instructor_id,
-                    }
-                )
-                self.client.put(new_instructor_entity)
+            def commit():
+                with self.client.transaction():
+                    course_entity = self.client.get(course_key)
+                    if not course_entity:
+                        raise CourseException(
+                            f"Course with ID {course_id} not found"
+                        )
+
+                    if instructor_entities:
+                        instructor_entity = instructor_entities[0]
+                    else:
+                        new_instructor_key = self.client.key(
+                            self.COURSE_INSTRUCTORS
+                        )
+                        instructor_entity = datastore.Entity(
+                            key=new_instructor_key
+                        )
+                        instructor_entity["course_id"] = course_id
+                    instructor_entity["instructor_id"] = new_instructor_id
+                    self.client.put(instructor_entity)
+
+            await run_blocking(commit)
+            _instructor_cache.pop(course_id, None)
 
             logger.info(
                 f"Successfully updated instructor for course {course_id} to {new_instructor_id}"
@@ -336,12 +483,13 @@ class CourseClient:
     async def delete_course(self, course_id: int) -> None:
         try:
             course_key = self.client.key(self.COURSES, course_id)
-            course_entity = self.client.get(course_key)
+            course_entity = await run_blocking(self.client.get, course_key)
 
             if not course_entity:
                 raise CourseException(f"Course with ID {course_id} not found")
 
-            self.client.delete(course_key)
+            await run_blocking(self.client.delete, course_key)
+            _course_cache.pop(course_id, None)
 
             logger.info(f"Successfully deleted course {course_id}")
 
@@ -358,11 +506,15 @@ class CourseClient:
             course_instructor_query.add_filter(
                 property_name="course_id", operator="=", value=course_id
             )
-            instructor_entities = list(course_instructor_query.fetch())
+            # only the keys are needed for the delete
+            course_instructor_query.keys_only()
+            instructor_keys = await run_blocking(
+                lambda: [e.key for e in course_instructor_query.fetch()]
+            )
 
-            if instructor_entities:
-                instructor_entity = instructor_entities[0]
-                self.client.delete(instructor_entity.key)
+            if instructor_keys:
+                await run_blocking(self.client.delete_multi, instructor_keys)
+            _instructor_cache.pop(course_id, None)
 
             logger.info(
                 f"Successfully deleted instructor for course {course_id}"
@@ -382,11 +534,13 @@ class CourseClient:
             course_enrollment_query.add_filter(
                 property_name="course_id", operator="=", value=course_id
             )
-            enrollment_entities = list(course_enrollment_query.fetch())
+            course_enrollment_query.keys_only()
+            enrollment_keys = await run_blocking(
+                lambda: [e.key for e in course_enrollment_query.fetch()]
+            )
 
-            if enrollment_entities:
-                for enrollment_entity in enrollment_entities:
-                    self.client.delete(enrollment_entity.key)
+            if enrollment_keys:
+                await run_blocking(self.client.delete_multi, enrollment_keys)
 
             logger.info(
                 f"Successfully deleted enrollments for course {course_id}"
@@ -403,7 +557,9 @@ class CourseClient:
             query = self.client.query(kind=self.COURSE_ENROLMENT)
             query.add_filter("course_id", "=", course_id)
             query.add_filter("student_id", "=", user_id)
-            results = list(query.fetch(limit=1))
+            # existence check, no need to pull the entity payload back
+            query.keys_only()
+            results = await run_blocking(lambda: list(query.fetch(limit=1)))
             return bool(len(results))
         except Exception as e:
             logger.error(
@@ -411,50 +567,85 @@ class CourseClient:
             )
             raise
 
-    async def add_users_to_course(self, user_ids: list[int], course_id: int):
-        if len(user_ids) == 0:
-            return
+    async def get_enrollment_keys(self, course_id: int) -> dict:
+        """
+        Returns a mapping of enrolled student_id -> enrollment entity key
+        for the given course
+        """
         try:
-            for user_id in user_ids:
-                enrolled = await self.check_if_enrolled(user_id, course_id)
-                if enrolled:
-                    continue
-                new_enrollment_key = self.client.key(self.COURSE_ENROLMENT)
-                new_course_enrollment = datastore.Entity(key=new_enrollment_key)
-                new_course_enrollment.update(
-                    {"course_id": course_id, "student_id": user_id}
-                )
-                self.client.put(new_course_enrollment)
-
+            query = self.client.query(kind=self.COURSE_ENROLMENT)
+            query.add_filter(
+                property_name="course_id", operator="=", value=course_id
+            )
+            entities = await run_blocking(lambda: list(query.fetch()))
+            return {entity["student_id"]: entity.key for entity in entities}
         except Exception as e:
-            logger.error(f"Error adding users to course {course_id}: {str(e)}")
+            logger.error(
+                f"Error fetching enrollments for course {course_id}: {str(e)}"
+            )
             raise
 
-    async def remove_users_from_course(
-        self, user_ids: list[int], course_id: int
-    ):
-        if len(user_ids) == 0:
+    async def update_enrollment(
+        self, course_id: int, add: list[int], remove: list[int]
+    ) -> None:
+        """
+        Apply adds and removes against one roster snapshot, with a single
+        batched write in each direction
+        """
+        if len(add) == 0 and len(remove) == 0:
             return
         try:
-            for user_id in user_ids:
-                enrolled = await self.check_if_enrolled(user_id, course_id)
-                if not enrolled:
-                    continue
-                enrollment_query = self.client.query(kind=self.COURSE_ENROLMENT)
-                enrollment_query.add_filter(
-                    property_name="course_id", operator="=", value=course_id
+            existing = await self.get_enrollment_keys(course_id)
+            new_student_ids = [
+                user_id for user_id in add if user_id not in existing
+            ]
+            keys_to_delete = [
+                existing[user_id] for user_id in remove if user_id in existing
+            ]
+
+            if (
+                new_student_ids
+                and not keys_to_delete
+                and enrollment_batcher.running
+            ):
+                # add-only updates funnel through the shared batcher so
+                # concurrent roster updates coalesce into one put_multi;
+                # mixed add+remove requests fall through to the
+                # transaction below so both directions commit atomically
+                await asyncio.gather(
+                    *[
+                        enrollment_batcher.enroll(course_id, user_id)
+                        for user_id in new_student_ids
+                    ]
                 )
-                enrollment_query.add_filter(
-                    property_name="student_id", operator="=", value=user_id
+                return
+
+            new_enrollments = []
+            for user_id in new_student_ids:
+                new_enrollment_key = self.client.key(self.COURSE_ENROLMENT)
+                new_course_enrollment = datastore.Entity(
+                    key=new_enrollment_key
                 )
-                enrollment_entities = list(enrollment_query.fetch())
+                new_course_enrollment.update(
+                    {"course_id": course_id, "student_id": user_id}
+                )
+                new_enrollments.append(new_course_enrollment)
+
+            if not new_enrollments and not keys_to_delete:
+                return
+
+            def commit():
+                # both mutation sets ride a single atomic commit
+                with self.client.transaction():
+                    if new_enrollments:
+                        self.client.put_multi(new_enrollments)
+                    if keys_to_delete:
+                        self.client.delete_multi(keys_to_delete)
 
-                if enrollment_entities:
-                    for enrollment_entity in enrollment_entities:
-                        self.client.delete(enrollment_entity.key)
+            await run_blocking(commit)
 
         except Exception as e:
             logger.error(
-                f"Error removing users from course {course_id}: {str(e)}"
+                f"Error updating enrollment for course {course_id}: {str(e)}"
             )
             raise
@@ -2,12 +2,22 @@ import logging
 from enum import Enum
 from typing import Literal, Optional, Union
 
+from cachetools import TTLCache
 from google.cloud import datastore
 from pydantic import BaseModel, ConfigDict
 
-logging.basicConfig(level=logging.INFO)
+from app.utils.datastore_utils import get_datastore_client, run_blocking
+
 logger = logging.getLogger(__name__)
 
+# users rarely change during a token's lifetime, so short-TTL cache the
+# sub -> User lookup that runs on every authenticated request
+_user_by_sub_cache = TTLCache(maxsize=4096, ttl=60)
+
+# avatar presence is read-heavy and only changes through the avatar
+# mutation paths, which update this cache in place
+_has_avatar_cache = TTLCache(maxsize=4096, ttl=30)
+
 
 class UserException(Exception):
     pass
@@ -42,15 +52,22 @@ class AvatarResponse(BaseModel):
 
 class UserClient:
     def __init__(self):
-        self.client = datastore.Client(database="tarpaulin")
+        self.client = get_datastore_client()
         self.USERS = "Users"
         self.USER_AVATAR = "UserAvatar"
+        # roles are effectively immutable, so a short TTL keeps repeat
+        # instructor/student validations out of datastore
+        self._role_cache = TTLCache(maxsize=4096, ttl=60)
 
     async def get_user_by_sub(self, sub) -> User | None:
+        cached = _user_by_sub_cache.get(sub)
+        if cached is not None:
+            return cached
+
         query = self.client.query(kind=self.USERS)
         query.add_filter(property_name="sub", operator="=", value=sub)
         try:
-            entity = list(query.fetch())
+            entity = await run_blocking(lambda: list(query.fetch()))
             if len(entity) == 0:
                 raise UserException("User not found")
             entity = entity[0]
@@ -60,33 +77,84 @@ class UserClient:
             raise
 
         if entity:
-            return User(**entity)
+            user = User(**entity)
+            _user_by_sub_cache[sub] = user
+            return user
         return None
 
     async def get_all_users(self) -> list[UserCore]:
+        # no projection here: a (role, sub) projection needs a composite
+        # index the deployment doesn't define, so fetch full entities
         query = self.client.query(kind=self.USERS)
-        entities = list(query.fetch())
-        for entity in entities:
-            entity["id"] = entity.key.id
-        return [UserCore(**entity) for entity in entities]
+        entities = await run_blocking(lambda: list(query.fetch()))
+        return [
+            UserCore.model_construct(
+                id=entity.key.id, role=entity["role"], sub=entity["sub"]
+            )
+            for entity in entities
+        ]
 
     async def get_user_by_id(self, id: int) -> User | None:
         user_key = self.client.key(self.USERS, id)
-        query = self.client.query(kind=self.USERS)
-        query.key_filter(user_key, "=")
         try:
-            entity = list(query.fetch())
-            if len(entity) == 0:
+            # direct key lookup instead of a key-filtered query
+            entity = await run_blocking(self.client.get, user_key)
+            if entity is None:
                 raise UserException("User not found")
-            entity = entity[0]
             entity["id"] = entity.key.id
         except Exception as e:
-            logger.error(f"Error fetching user by sub: {e}")
+            logger.error(f"Error fetching user by id: {e}")
             raise
 
-        if entity:
-            return User(**entity)
-        return None
+        return User(**entity)
+
+    async def get_user_with_avatar(self, id: int) -> tuple[User, bool]:
+        """
+        Returns the user and whether they have an avatar from a single
+        kindless ancestor query instead of two round trips
+        """
+        user_key = self.client.key(self.USERS, id)
+        query = self.client.query(ancestor=user_key)
+        try:
+            entities = await run_blocking(lambda: list(query.fetch()))
+        except Exception as e:
+            logger.error(f"Error fetching user {id} with avatar: {e}")
+            raise
+
+        user_entity = None
+        has_avatar = False
+        for entity in entities:
+            if entity.key.kind == self.USERS:
+                user_entity = entity
+            elif entity.key.kind == self.USER_AVATAR:
+                has_avatar = True
+
+        if user_entity is None:
+            raise UserException("User not found")
+
+        user_entity["id"] = user_entity.key.id
+        return User(**user_entity), has_avatar
+
+    async def get_users_by_ids(self, ids: list[int]) -> dict[int, User]:
+        """
+        Fetches several users in one get_multi round trip; ids with no
+        matching entity are simply absent from the returned mapping
+        """
+        if not ids:
+            return {}
+
+        keys = [self.client.key(self.USERS, user_id) for user_id in ids]
+        try:
+            entities = await run_blocking(self.client.get_multi, keys)
+        except Exception as e:
+            logger.error(f"Error fetching users by ids: {e}")
+            raise
+
+        users = {}
+        for entity in entities:
+            entity["id"] = entity.key.id
+            users[entity["id"]] = User(**entity)
+        return users
 
     async def get_user_role(
         self, access: Union[Literal["id"], Literal["sub"]], id
@@ -95,6 +163,10 @@ class UserClient:
         Returns the role of the given user
         """
 
+        cached = self._role_cache.get((access, id))
+        if cached is not None:
+            return cached
+
         if access == "id":
             user = await self.get_user_by_id(id)
         else:
@@ -104,20 +176,35 @@ class UserClient:
             logger.error(f"Could not get user via {access} with token {id}")
             raise UserException("User not found")
 
+        self._role_cache[(access, id)] = user.role
         return user.role
 
     async def verify_user_has_avatar(self, id: int) -> bool:
+        cached = _has_avatar_cache.get(id)
+        if cached is not None:
+            return cached
+
         try:
             user_key = self.client.key(self.USERS, id)
             query = self.client.query(kind=self.USER_AVATAR, ancestor=user_key)
-            avatars = list(query.fetch(limit=1))
-            return len(avatars) > 0
+            # existence check, so don't pull entity properties back
+            query.keys_only()
+            avatars = await run_blocking(
+                lambda: list(query.fetch(limit=1))
+            )
+            has_avatar = len(avatars) > 0
+            _has_avatar_cache[id] = has_avatar
+            return has_avatar
 
         except Exception as e:
             logger.error(f"Error checking user avatar for user {id}: {e}")
             return False
 
-    async def create_user_avatar_record(self, user_id: int) -> None:
+    async def create_user_avatar_record(self, user_id: int) -> bool:
+        """
+        Creates the avatar record if missing; returns whether this call
+        actually created it so callers can undo only their own write
+        """
         try:
             # no need if user already has avatar
             has_avatar = await self.verify_user_has_avatar(user_id)
@@ -125,7 +212,7 @@ class UserClient:
                 logger.info(
                     f"User {user_id} already has an avatar record, skipping creation"
                 )
-                return
+                return False
 
             user_key = self.client.key(self.USERS, user_id)
 
@@ -134,9 +221,11 @@ class UserClient:
 
             avatar_entity["file"] = f"{user_id}.png"
 
-            self.client.put(avatar_entity)
+            await run_blocking(self.client.put, avatar_entity)
+            _has_avatar_cache[user_id] = True
 
             logger.info(f"Created avatar record for user {user_id}")
+            return True
 
         except Exception as e:
             logger.error(
@@ -144,6 +233,38 @@ class UserClient:
             )
             raise
 
+    async def delete_user_avatar_records(self, user_ids: list[int]) -> None:
+        """
+        Removes several users' avatar records with one delete_multi
+        instead of a round trip per user
+        """
+        if not user_ids:
+            return
+
+        def collect_keys():
+            keys = []
+            for user_id in user_ids:
+                user_key = self.client.key(self.USERS, user_id)
+                query = self.client.query(
+                    kind=self.USER_AVATAR, ancestor=user_key
+                )
+                query.keys_only()
+                keys.extend(entity.key for entity in query.fetch())
+            return keys
+
+        try:
+            keys = await run_blocking(collect_keys)
+            if keys:
+                await run_blocking(self.client.delete_multi, keys)
+            for user_id in user_ids:
+                _has_avatar_cache[user_id] = False
+
+            logger.info(f"Deleted avatar records for {len(user_ids)} users")
+
+        except Exception as e:
+            logger.error(f"Error deleting avatar records: {e}")
+            raise
+
     async def delete_user_avatar_record(self, user_id: int) -> None:
         try:
             has_avatar = await self.verify_user_has_avatar(user_id)
@@ -155,10 +276,11 @@ class UserClient:
 
             user_key = self.client.key(self.USERS, user_id)
             query = self.client.query(kind=self.USER_AVATAR, ancestor=user_key)
-            avatars = list(query.fetch())
+            avatars = await run_blocking(lambda: list(query.fetch()))
 
             for avatar in avatars:
-                self.client.delete(avatar.key)
+                await run_blocking(self.client.delete, avatar.key)
+            _has_avatar_cache[user_id] = False
 
             logger.info(f"Deleted avatar record for user {user_id}")
 
@@ -1,11 +1,20 @@
+import asyncio
 import logging
 from typing import Annotated
 
+import orjson
 from fastapi import APIRouter, Depends, Query, Request
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
-
-from app.dependencies import get_user_info
+from fastapi.responses import ORJSONResponse, Response
+
+from app.dependencies import (
+    base_url,
+    get_course_client,
+    get_jwt_utils,
+    get_user_client,
+    get_user_info,
+    require_admin,
+)
 from app.models.courses import (
     CourseClient,
     CourseEnrollmentUpdate,
@@ -16,9 +25,7 @@ from app.models.courses import (
     CoursesResponse,
 )
 from app.models.users import User, UserClient, UserException, UserRoles
-from app.utils.jwt_utils import JWTUtils
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 error_responses = {
@@ -30,31 +37,42 @@ error_responses = {
     500: {"Error": "Internal server error"},
 }
 
+# payloads serialized once at import; middleware mutates response
+# headers in place, so each return wraps the shared bytes in a fresh
+# Response instead of reusing one instance across requests
+_error_payloads = {
+    status: orjson.dumps(content)
+    for status, content in error_responses.items()
+}
+
+
+def error_response(status: int) -> Response:
+    return Response(
+        content=_error_payloads[status],
+        status_code=status,
+        media_type="application/json",
+    )
+
+
 router = APIRouter(
     prefix="/courses",
     tags=["courses"],
     responses={**error_responses},
+    default_response_class=ORJSONResponse,
 )
 
-jwt_utils = JWTUtils()
+jwt_utils = get_jwt_utils()
 
 
 @router.post("", response_model=CourseResponse, status_code=201)
 async def add_new_course(
-    user: Annotated[User | None, Depends(get_user_info)],
+    # resolved before the body so non-admin calls skip CoursePost validation
+    user: Annotated[User, Depends(require_admin)],
     post: CoursePost,
-    request: Request,
+    base: Annotated[str, Depends(base_url)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
 ):
-    if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
-
-    if user.role != UserRoles.ADMIN.value:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    scheme, netloc, *_ = request.url.components
-    user_client = UserClient()
-    course_client = CourseClient()
-
     try:
         role = await user_client.get_user_role("id", post.instructor_id)
 
@@ -64,223 +82,195 @@ async def add_new_course(
         logger.error(
             f"Error getting user role for instructor {post.instructor_id}: {e}"
         )
-        return JSONResponse(content=error_responses[400], status_code=400)
+        return error_response(400)
 
     try:
         course_id = await course_client.create_course(post)
     except Exception as e:
         logger.error(f"Error creating course {post}: {e}")
-        return JSONResponse(content={"Error": "Server error"}, status_code=500)
+        return error_response(500)
 
-    return CourseResponse(
+    return CourseResponse.model_construct(
         id=course_id,
         title=post.title,
         number=post.number,
         term=post.term,
         instructor_id=post.instructor_id,
         subject=post.subject,
-        self=f"{scheme}://{netloc}/courses/{course_id}",
+        self=f"{base}/courses/{course_id}",
     )
 
 
 @router.get("/{course_id}", response_model=CourseResponse)
 async def get_course(
     course_id: int,
-    request: Request,
+    base: Annotated[str, Depends(base_url)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
 ):
-    scheme, netloc, *_ = request.url.components
-    course_client = CourseClient()
     try:
-        course = await course_client.get_course(course_id)
+        # independent reads, so overlap them instead of paying two RTTs
+        course, instructor = await asyncio.gather(
+            course_client.get_course(course_id),
+            course_client.get_instructor(course_id),
+        )
     except CourseException as e:
         logger.error(f"Error getting course {course_id}: {e}")
-        return JSONResponse(content=error_responses[404], status_code=404)
+        return error_response(404)
     except Exception as e:
         logger.error(f"Unexpected error getting course {course_id}: {e}")
         raise HTTPException(
             status_code=500, detail="Internal Server Error"
         ) from e
 
-    # courses always have an instructor
-    try:
-        instructor = await course_client.get_instructor(course_id)
-    except Exception as e:
-        logger.error(
-            f"Unexpected error getting instructor {course.instructor_id}: {e}"
-        )
-        raise HTTPException(
-            status_code=500, detail="Internal Server Error"
-        ) from e
-
-    return CourseResponse(
+    return CourseResponse.model_construct(
         id=course_id,
         number=course.number,
         title=course.title,
         subject=course.subject,
         term=course.term,
         instructor_id=instructor,
-        self=f"{scheme}://{netloc}/courses/{course_id}",
+        self=f"{base}/courses/{course_id}",
     )
 
 
 @router.get("", response_model=CoursesResponse)
 async def get_courses(
     user: Annotated[User | None, Depends(get_user_info)],
-    request: Request,
+    base: Annotated[str, Depends(base_url)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
     offset: Annotated[
         int, Query(ge=0, description="Offset for pagination")
     ] = 0,
     limit: Annotated[int, Query(ge=1, description="Limit for pagination")] = 3,
 ):
-    scheme, netloc, *_ = request.url.components
-    course_client = CourseClient()
-
     try:
         courses = await course_client.get_courses(offset=offset, limit=limit)
     except CourseException as e:
         logger.error(f"Error getting courses: {e}")
-        return JSONResponse(content=error_responses[404], status_code=404)
+        return error_response(404)
     except Exception as e:
         logger.error(f"Unexpected error getting courses: {e}")
         raise HTTPException(
             status_code=500, detail="Internal Server Error"
         ) from e
 
-    course_responses = []
-    for course in courses:
-        course_responses.append(
-            CourseResponse(
-                id=course.id,
-                number=course.number,
-                title=course.title,
-                subject=course.subject,
-                term=course.term,
-                instructor_id=course.instructor_id,
-                self=f"{scheme}://{netloc}/courses/{course.id}",
-            )
+    # the prefix is loop-invariant and the course data is already
+    # validated, so build the rows without a second Pydantic pass
+    course_responses = [
+        CourseResponse.model_construct(
+            id=course.id,
+            number=course.number,
+            title=course.title,
+            subject=course.subject,
+            term=course.term,
+            instructor_id=course.instructor_id,
+            self=f"{base}/courses/{course.id}",
         )
+        for course in courses
+    ]
 
     return CoursesResponse(
         courses=course_responses,
-        next=f"{scheme}://{netloc}/courses?offset={offset + limit}&limit={limit}",
+        next=f"{base}/courses?offset={offset + limit}&limit={limit}",
     )
 
 
 @router.patch("/{course_id}", response_model=CourseResponse)
 async def update_course(  # noqa: C901
     course_id: int,
+    user: Annotated[User, Depends(require_admin)],
     course: CoursePut,
-    request: Request,
-    user: Annotated[User | None, Depends(get_user_info)],
+    base: Annotated[str, Depends(base_url)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
 ):
-    if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
-
-    if user.role != UserRoles.ADMIN.value:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    scheme, netloc, *_ = request.url.components
-    course_client = CourseClient()
-    user_client = UserClient()
-
     update_data = course.model_dump(exclude_none=True)
 
     try:
         existing_course = await course_client.get_course(course_id)
         if not existing_course:
-            return JSONResponse(content=error_responses[404], status_code=404)
+            return error_response(404)
     except CourseException:
-        return JSONResponse(content=error_responses[404], status_code=404)
+        return error_response(404)
     except Exception as e:
         logger.error(f"Error checking course existence {course_id}: {e}")
-        return JSONResponse(content={"Error": "Server error"}, status_code=500)
+        return error_response(500)
 
     try:
         if not update_data:
             instructor_id = await course_client.get_instructor(course_id)
-            return CourseResponse(
+            return CourseResponse.model_construct(
                 id=course_id,
                 number=existing_course.number,
                 title=existing_course.title,
                 subject=existing_course.subject,
                 term=existing_course.term,
                 instructor_id=instructor_id,
-                self=f"{scheme}://{netloc}/courses/{course_id}",
+                self=f"{base}/courses/{course_id}",
             )
 
+        instructor_id = None
         if "instructor_id" in update_data:
             instructor_id = update_data.pop("instructor_id")
 
             try:
                 role = await user_client.get_user_role("id", instructor_id)
                 if role != UserRoles.INSTRUCTOR.value:
-                    return JSONResponse(
-                        content=error_responses[400], status_code=400
-                    )
+                    return error_response(400)
             except UserException:
-                return JSONResponse(
-                    content=error_responses[400], status_code=400
-                )
+                return error_response(400)
 
             await course_client.update_instructor(course_id, instructor_id)
 
         if update_data:
             await course_client.update_course(course_id, update_data)
 
-        updated_course = await course_client.get_course(course_id)
-        instructor_id = await course_client.get_instructor(course_id)
+        # the course was fetched above and the updated values are in hand,
+        # so merge them in memory instead of re-reading the entity; only
+        # the instructor needs a lookup when this update didn't set it
+        for field, value in update_data.items():
+            setattr(existing_course, field, value)
+        if instructor_id is None:
+            instructor_id = await course_client.get_instructor(course_id)
 
-        return CourseResponse(
+        return CourseResponse.model_construct(
             id=course_id,
-            number=updated_course.number,
-            title=updated_course.title,
-            subject=updated_course.subject,
-            term=updated_course.term,
+            number=existing_course.number,
+            title=existing_course.title,
+            subject=existing_course.subject,
+            term=existing_course.term,
             instructor_id=instructor_id,
-            self=f"{scheme}://{netloc}/courses/{course_id}",
+            self=f"{base}/courses/{course_id}",
         )
 
     except CourseException as e:
         logger.error(f"CourseException updating course {course_id}: {e}")
-        return JSONResponse(content=error_responses[404], status_code=404)
+        return error_response(404)
     except UserException as e:
         logger.error(f"UserException updating course {course_id}: {e}")
-        return JSONResponse(content=error_responses[400], status_code=400)
+        return error_response(400)
     except Exception as e:
         logger.error(f"Error updating course {course_id}: {e}")
-        return JSONResponse(content={"Error": "Server error"}, status_code=500)
+        return error_response(500)
 
 
 @router.delete("/{course_id}", status_code=204, response_model=None)
 async def delete_course(
     course_id: int,
     request: Request,
-    user: Annotated[User | None, Depends(get_user_info)],
+    user: Annotated[User, Depends(require_admin)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
 ):
-    if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
-
-    if user.role != UserRoles.ADMIN.value:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    course_client = CourseClient()
     try:
-        await course_client.delete_course(course_id)
+        # the three cleanups touch disjoint kinds, so run them together
+        await asyncio.gather(
+            course_client.delete_course(course_id),
+            course_client.delete_course_instructor(course_id),
+            course_client.delete_course_enrollment(course_id),
+        )
     except Exception as e:
         logger.error(f"Error deleting course {course_id}: {e}")
-        return JSONResponse(content={"Error": "Server error"}, status_code=500)
-
-    try:
-        await course_client.delete_course_instructor(course_id)
-    except Exception as e:
-        logger.error(f"Error deleting instructor for course {course_id}: {e}")
-        return JSONResponse(content={"Error": "Server error"}, status_code=500)
-
-    try:
-        await course_client.delete_course_enrollment(course_id)
-    except Exception as e:
-        logger.error(f"Error deleting student for course {course_id}: {e}")
-        return JSONResponse(content={"Error": "Server error"}, status_code=500)
+        return error_response(500)
 
 
 @router.patch("/{course_id}/students", response_model=None)
@@ -289,82 +279,78 @@ async def update_course_enrollment(  # noqa: C901
     request: Request,
     update: CourseEnrollmentUpdate,
     user: Annotated[User | None, Depends(get_user_info)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
 ):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user.role == UserRoles.STUDENT.value:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    course_client = CourseClient()
+        return error_response(403)
+
+    add_ids = set(update.add)
+    remove_ids = set(update.remove)
+    if not add_ids.isdisjoint(remove_ids):
+        return error_response(409)
+
+    # the instructor check, course existence check, and user lookups are
+    # independent reads, so overlap them
+    user_ids = list(add_ids | remove_ids)
+    results = await asyncio.gather(
+        course_client.get_instructor(course_id),
+        course_client.get_course(course_id),
+        user_client.get_users_by_ids(user_ids),
+        return_exceptions=True,
+    )
+    course_instructor_id, course, users = results
 
-    # check if the user is the instructor of the course
-    course_instructor_id = await course_client.get_instructor(course_id)
+    if isinstance(course, CourseException):
+        logger.error(f"No course found with id: {course_id}")
+        return error_response(403)
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error(f"Error validating course update: {result}")
+            return error_response(500)
 
     if (
         user.id != course_instructor_id
         and user.role == UserRoles.INSTRUCTOR.value
     ):
-        return JSONResponse(content=error_responses[403], status_code=403)
+        return error_response(403)
 
     try:
-        await course_client.get_course(course_id)
-    except CourseException:
-        logger.error(f"No course found with id: {course_id}")
-        return JSONResponse(content=error_responses[403], status_code=403)
+        for user_id in user_ids:
+            enrollee = users.get(user_id)
+            if enrollee is None:
+                logger.error("Entered user not found")
+                return error_response(409)
+            if enrollee.role != UserRoles.STUDENT.value:
+                return error_response(409)
 
-    try:
-        user_client = UserClient()
-        for user_id in update.add:
-            user_role = await user_client.get_user_role("id", user_id)
-            if user_role != UserRoles.STUDENT.value:
-                return JSONResponse(
-                    content=error_responses[409], status_code=409
-                )
-            if user_id in update.remove:
-                return JSONResponse(
-                    content=error_responses[409], status_code=409
-                )
-
-        for user_id in update.remove:
-            user_role = await user_client.get_user_role("id", user_id)
-            if user_role != UserRoles.STUDENT.value:
-                return JSONResponse(
-                    content=error_responses[409], status_code=409
-                )
-
-    except UserException:
-        logger.error("Entered user not found")
-        return JSONResponse(content=error_responses[409], status_code=409)
     except Exception as e:
         logger.error(f"Error validating course update: {e}")
-        return JSONResponse(content=error_responses[500], status_code=500)
+        return error_response(500)
 
     try:
-        await course_client.add_users_to_course(update.add, course_id)
-    except Exception as e:
-        logger.error(f"Error adding users to course: {e}")
-        return JSONResponse(content=error_responses[500], status_code=500)
-
-    try:
-        await course_client.remove_users_from_course(update.remove, course_id)
+        await course_client.update_enrollment(
+            course_id, update.add, update.remove
+        )
     except Exception as e:
-        logger.error(f"Error removing users from course: {e}")
-        return JSONResponse(content=error_responses[500], status_code=500)
+        logger.error(f"Error updating course enrollment: {e}")
+        return error_response(500)
 
 
 @router.get("/{course_id}/students", response_model=list[int])
 async def get_course_students(
     course_id: int,
     user: Annotated[User | None, Depends(get_user_info)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
 ):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user.role == UserRoles.STUDENT.value:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    course_client = CourseClient()
+        return error_response(403)
 
     # check if the user is the instructor of the course
     course_instructor_id = await course_client.get_instructor(course_id)
@@ -373,17 +359,16 @@ async def get_course_students(
         user.id != course_instructor_id
         and user.role == UserRoles.INSTRUCTOR.value
     ):
-        return JSONResponse(content=error_responses[403], status_code=403)
+        return error_response(403)
 
     try:
         await course_client.get_course(course_id)
     except CourseException:
         logger.error(f"No course found with id: {course_id}")
-        return JSONResponse(content=error_responses[403], status_code=403)
-    course_client = CourseClient()
+        return error_response(403)
     try:
         students = await course_client.get_course_students(course_id)
     except Exception as e:
         logger.error(f"Error getting course students: {e}")
-        return JSONResponse(content=error_responses[500], status_code=500)
+        return error_response(500)
     return students
@@ -1,11 +1,23 @@
+import asyncio
 import logging
 from typing import Annotated
 
-import requests
-from fastapi import APIRouter, Depends, File, Request
-from fastapi.responses import JSONResponse, Response
+import httpx
+import orjson
+from fastapi import APIRouter, Depends, UploadFile
+from fastapi.responses import (
+    ORJSONResponse,
+    RedirectResponse,
+    Response,
+)
 
-from app.dependencies import get_user_info
+from app.dependencies import (
+    base_url,
+    get_course_client,
+    get_jwt_utils,
+    get_user_client,
+    get_user_info,
+)
 from app.models.auth import LoginPost, LoginResponse
 from app.models.courses import CourseClient
 from app.models.users import (
@@ -16,10 +28,9 @@ from app.models.users import (
     UserResponse,
     UserRoles,
 )
-from app.utils.jwt_utils import JWTUtils
+from app.utils.datastore_utils import run_blocking
 from app.utils.storage_utils import StorageHandler
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -28,15 +39,41 @@ error_responses = {
     401: {"Error": "Unauthorized"},
     403: {"Error": "You don't have permission on this resource"},
     404: {"Error": "Not found"},
+    500: {"Error": "Internal server error"},
+}
+
+# payloads serialized once at import; middleware mutates response
+# headers in place, so each return wraps the shared bytes in a fresh
+# Response instead of reusing one instance across requests
+_error_payloads = {
+    status: orjson.dumps(content)
+    for status, content in error_responses.items()
 }
 
+
+def error_response(status: int) -> Response:
+    return Response(
+        content=_error_payloads[status],
+        status_code=status,
+        media_type="application/json",
+    )
+
+
 router = APIRouter(
     prefix="/users",
     tags=["users"],
     responses={**error_responses},
+    default_response_class=ORJSONResponse,
 )
 
-jwt_utils = JWTUtils()
+jwt_utils = get_jwt_utils()
+
+# shared client so logins reuse the same keep-alive connection to auth0;
+# a 30s keepalive_expiry keeps the TLS session warm between login bursts
+http_client = httpx.AsyncClient(
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=64, keepalive_expiry=30),
+)
 
 
 @router.post("/login", response_model=LoginResponse)
@@ -49,17 +86,17 @@ async def login(login: LoginPost):
         "client_secret": jwt_utils.get_client_secret(),
     }
     headers = {"content-type": "application/json"}
-    url = "https://" + jwt_utils.get_domain() + "/oauth/token"
+    url = jwt_utils.get_oauth_url()
 
     try:
-        resp = requests.post(url, json=body, headers=headers)
+        resp = await http_client.post(url, json=body, headers=headers)
     except Exception as e:
         logger.error(f"Exception raised: {str(e)}")
         raise
     content = resp.json()
     if "error" in content:
         logger.error(f"Error response from auth0: {content}")
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
     return LoginResponse(token=content["id_token"])
 
 
@@ -68,14 +105,15 @@ async def login(login: LoginPost):
 
 
 @router.get("", response_model=list[UserCore])
-async def get_users(user: Annotated[User | None, Depends(get_user_info)]):
+async def get_users(
+    user: Annotated[User | None, Depends(get_user_info)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
+):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user.role != UserRoles.ADMIN.value:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    user_client = UserClient()
+        return error_response(403)
 
     return await user_client.get_all_users()
 
@@ -86,38 +124,38 @@ async def get_users(user: Annotated[User | None, Depends(get_user_info)]):
 async def get_user(
     user_id: int,
     user: Annotated[User | None, Depends(get_user_info)],
-    request: Request,
+    base: Annotated[str, Depends(base_url)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
+    course_client: Annotated[CourseClient, Depends(get_course_client)],
 ):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user.role != UserRoles.ADMIN.value and user_id != user.id:
-        return JSONResponse(content=error_responses[403], status_code=403)
+        return error_response(403)
+
+    # the user+avatar ancestor query and the enrollment lookup are
+    # independent, so overlap them; the courses result is simply
+    # discarded when the target turns out to be an admin
+    user_result, course_result = await asyncio.gather(
+        user_client.get_user_with_avatar(user_id),
+        course_client.get_user_courses(user_id),
+        return_exceptions=True,
+    )
 
-    user_client = UserClient()
-    scheme, netloc, *_ = request.url.components
+    if isinstance(user_result, BaseException):
+        return error_response(403)
+    retrieved_user, has_avatar = user_result
 
-    try:
-        retrieved_user = await user_client.get_user_by_id(user_id)
-        if retrieved_user is None:
-            raise Exception
-    except Exception:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    avatar_url = (
-        f"{scheme}://{netloc}/users/{user_id}/avatar"
-        if await user_client.verify_user_has_avatar(user_id)
-        else None
-    )
+    avatar_url = f"{base}/users/{user_id}/avatar" if has_avatar else None
 
     if retrieved_user.role == UserRoles.ADMIN.value:
         course_urls = None
     else:
-        course_client = CourseClient()
-        course_ids = await course_client.get_user_courses(user_id)
+        if isinstance(course_result, BaseException):
+            raise course_result
         course_urls = [
-            f"{scheme}://{netloc}/courses/{course_id}"
-            for course_id in course_ids
+            f"{base}/courses/{course_id}" for course_id in course_result
         ]
 
     return UserResponse(
@@ -134,74 +172,126 @@ async def get_user_avatar(
     user_id: int, user: Annotated[User | None, Depends(get_user_info)]
 ):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user_id != user.id:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    user_client = UserClient()
-
-    has_avatar = await user_client.verify_user_has_avatar(user_id)
-    if not has_avatar:
-        return JSONResponse(content=error_responses[404], status_code=404)
+        return error_response(403)
 
     try:
-        file_obj = StorageHandler.get_avatar(user_id)
-        file_bytes = file_obj.read()
-
-        logger.info("Returning Response with file bytes")
-        return Response(content=file_bytes, media_type="image/png")
+        # send the client straight to the bucket; the worker only does
+        # the auth check and never touches the image bytes, and a
+        # missing object surfaces from the signing helper as a 404.
+        # the metadata/signing RPCs run off the event loop
+        signed_url = await run_blocking(
+            StorageHandler.get_avatar_url, user_id
+        )
+        return RedirectResponse(url=signed_url, status_code=307)
     except Exception as e:
         logger.error(f"Error retrieving avatar for user {user_id}: {e}")
-        return JSONResponse(content=error_responses[404], status_code=404)
+        return error_response(404)
 
 
 @router.post("/{user_id}/avatar", response_model=AvatarResponse)
 async def upload_user_avatar(
     user_id: int,
     user: Annotated[User | None, Depends(get_user_info)],
-    request: Request,
-    file: Annotated[bytes, File()],
+    base: Annotated[str, Depends(base_url)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
+    file: UploadFile,
 ):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user_id != user.id:
-        return JSONResponse(content=error_responses[403], status_code=403)
+        return error_response(403)
+
+    async def upload_with_retry():
+        # run the GCS put in a worker thread so it doesn't stall the
+        # event loop, retrying transient failures with a short backoff
+        for attempt in range(3):
+            try:
+                return await run_blocking(
+                    StorageHandler.upload_avatar, file.file, f"{user_id}.png"
+                )
+            except Exception:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(0.1 * 2**attempt)
+
+    # the blob upload and the datastore record are independent writes,
+    # so overlap them instead of paying for both in sequence
+    upload_result, record_result = await asyncio.gather(
+        upload_with_retry(),
+        user_client.create_user_avatar_record(user_id),
+        return_exceptions=True,
+    )
 
-    user_client = UserClient()
-    scheme, netloc, *_ = request.url.components
+    upload_failed = isinstance(upload_result, BaseException)
+    record_failed = isinstance(record_result, BaseException)
+    if upload_failed or record_failed:
+        logger.error(
+            f"Error uploading avatar for user {user_id}: "
+            f"{upload_result if upload_failed else record_result}"
+        )
+        # undo whichever half this request created so the blob and the
+        # record agree; a pre-existing record from an earlier upload is
+        # left alone
+        try:
+            if not record_failed and record_result:
+                await user_client.delete_user_avatar_record(user_id)
+            if not upload_failed:
+                await run_blocking(StorageHandler.delete_avatar, user_id)
+        except Exception as e:
+            logger.error(
+                f"Error undoing partial avatar upload for {user_id}: {e}"
+            )
+        return error_response(500)
+
+    return AvatarResponse(avatar_url=f"{base}/users/{user_id}/avatar")
+
+
+@router.delete("/avatars", status_code=204)
+async def delete_user_avatars(
+    user_ids: list[int],
+    user: Annotated[User | None, Depends(get_user_info)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
+):
+    if user is None:
+        return error_response(401)
+
+    if user.role != UserRoles.ADMIN.value:
+        return error_response(403)
 
     try:
-        StorageHandler.upload_avatar(file, f"{user_id}.png")
-        await user_client.create_user_avatar_record(user_id)
-        return AvatarResponse(
-            avatar_url=f"{scheme}://{netloc}/users/{user_id}/avatar"
+        # the blob batch and the record cleanup are independent, so run
+        # them together, each off the event loop
+        await asyncio.gather(
+            run_blocking(StorageHandler.delete_avatars, user_ids),
+            user_client.delete_user_avatar_records(user_ids),
         )
     except Exception as e:
-        logger.error(f"Error uploading avatar for user {user_id}: {e}")
-        return JSONResponse(content=error_responses[500], status_code=500)
+        logger.error(f"Error deleting avatars: {e}")
+        return error_response(500)
 
 
 @router.delete("/{user_id}/avatar", status_code=204)
 async def delete_user_avatar(
     user_id: int,
     user: Annotated[User | None, Depends(get_user_info)],
+    user_client: Annotated[UserClient, Depends(get_user_client)],
 ):
     if user is None:
-        return JSONResponse(content=error_responses[401], status_code=401)
+        return error_response(401)
 
     if user_id != user.id:
-        return JSONResponse(content=error_responses[403], status_code=403)
-
-    user_client = UserClient()
+        return error_response(403)
 
     try:
         user_has_avatar = await user_client.verify_user_has_avatar(user_id)
         if not user_has_avatar:
-            return JSONResponse(content=error_responses[404], status_code=404)
+            return error_response(404)
         await user_client.delete_user_avatar_record(user_id)
         StorageHandler.delete_avatar(user_id)
     except Exception as e:
         logger.error(f"Error deleting avatar for user {user_id}: {e}")
-        return JSONResponse(content=error_responses[500], status_code=500)
+        return error_response(500)
@@ -0,0 +1,21 @@
+import asyncio
+from functools import lru_cache
+
+from google.cloud import datastore
+
+
+@lru_cache(maxsize=1)
+def get_datastore_client() -> datastore.Client:
+    """
+    Single shared datastore client so every request reuses the same
+    gRPC channel instead of re-doing the TCP+TLS handshake
+    """
+    return datastore.Client(database="tarpaulin")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Run a blocking google-cloud call in a worker thread so it doesn't
+    stall the event loop
+    """
+    return await asyncio.to_thread(fn, *args, **kwargs)
@@ -1,14 +1,27 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import jwt
+from cachetools import TLRUCache
 from fastapi import Request
 from google.cloud import secretmanager
 from jwt import PyJWKClient
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _token_ttu(_key, claims: dict, now: float) -> float:
+    # expire the entry when the token itself expires, capped at 5 minutes
+    return min(claims.get("exp", now), now + 300)
+
+
+# decoded claims keyed by the raw token string; only successful decodes
+# are inserted, so failures are always re-verified
+_decoded_token_cache = TLRUCache(maxsize=4096, ttu=_token_ttu, timer=time.time)
+
+
 class AuthError(Exception):
     def __init__(self, message: str, status_code: int):
         self.message = message
@@ -18,25 +31,21 @@ class AuthError(Exception):
 class JWTUtils:
     """Configuration for JWT token generation and validation."""
 
-    _instance = None
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._initialized = False
-        return cls._instance
+    # one JWKS client per url; PyJWKClient caches the fetched signing keys
+    # internally, so reusing it keeps the jwks.json fetch off the hot path
+    _jwks_clients: dict[str, PyJWKClient] = {}
 
     def __init__(self):
-        if self._initialized:
-            return
-        self._secret_client = secretmanager.SecretManagerServiceClient()
+        self._secret_client = None
+        self._config_lock = threading.Lock()
         self.CLIENT_ID = None
         self.CLIENT_SECRET = None
         self.DOMAIN = None
         self.ALGORITHM = ["RS256"]
-        self._initialized = True
-
-        self._load_config()
+        # derived strings, filled in once the domain is known
+        self.OAUTH_URL = None
+        self.JWKS_URL = None
+        self.ISSUER = None
 
     def _get_secret(self, secret_id):
         try:
@@ -50,10 +59,43 @@ class JWTUtils:
         return resp.payload.data.decode("UTF-8")
 
     def _load_config(self):
-        if self.CLIENT_ID is None:
-            self.CLIENT_ID = self._get_secret("client_id")
-            self.CLIENT_SECRET = self._get_secret("client_secret")
-            self.DOMAIN = self._get_secret("oauth_domain")
+        with self._config_lock:
+            if self.CLIENT_ID is not None:
+                return
+            if self._secret_client is None:
+                self._secret_client = (
+                    secretmanager.SecretManagerServiceClient()
+                )
+            # the three secrets are independent, so fetch them together
+            # and pay for one RPC of wall time instead of three
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                self.CLIENT_ID, self.CLIENT_SECRET, self.DOMAIN = pool.map(
+                    self._get_secret,
+                    ["client_id", "client_secret", "oauth_domain"],
+                )
+            # invariant after load, so build them once instead of
+            # re-concatenating on every token validation and login
+            self.OAUTH_URL = "https://" + self.DOMAIN + "/oauth/token"
+            self.JWKS_URL = "https://" + self.DOMAIN + "/.well-known/jwks.json"
+            self.ISSUER = "https://" + self.DOMAIN + "/"
+            # warm the verifying client so the first validation only
+            # pays for the key fetch, not client setup
+            self._get_jwks_client(self.JWKS_URL)
+
+    def _get_jwks_client(self, url: str) -> PyJWKClient:
+        client = self._jwks_clients.get(url)
+        if client is None:
+            client = self._jwks_clients.setdefault(
+                url,
+                PyJWKClient(
+                    url,
+                    headers={"User-agent": "custom-user-agent"},
+                    cache_keys=True,
+                    max_cached_keys=16,
+                    lifespan=3600,
+                ),
+            )
+        return client
 
     def get_client_id(self) -> str:
         if self.CLIENT_ID is None:
@@ -73,6 +115,15 @@ class JWTUtils:
             raise ValueError("JWT configuration is not loaded")
         return self.CLIENT_SECRET
 
+    def get_oauth_url(self) -> str:
+        if self.OAUTH_URL is None:
+            self._load_config()
+
+        if self.OAUTH_URL is None:
+            logger.error("Error setting JWT config")
+            raise ValueError("JWT configuration is not loaded")
+        return self.OAUTH_URL
+
     def get_domain(self) -> str:
         if self.DOMAIN is None:
             self._load_config()
@@ -107,26 +158,29 @@ class JWTUtils:
     async def validate_token(self, request: Request) -> dict:
         """Validate a JWT token and return the payload if valid."""
         token = self.extract_token(request)
-        try:
-            unverified_header = jwt.get_unverified_header(token)
-        except jwt.PyJWTError as e:
-            logger.error(f"Invalid header: {e}")
-            raise
 
-        if unverified_header["alg"] not in self.ALGORITHM:
-            logger.error(f"Invalid algorithm: {unverified_header['alg']}")
-            raise AuthError("Invalid algorithm", status_code=401)
+        # tokens in the cache have already passed signature + claim
+        # checks, so a hit only needs its exp re-checked
+        cached = _decoded_token_cache.get(token)
+        if cached is not None and cached.get("exp", 0) > time.time():
+            return cached
 
+        # no header pre-parse needed: jwt.decode enforces the
+        # algorithm whitelist itself
         return await self.decode_token(token)
 
     async def decode_token(self, token: str) -> dict:
+        cached = _decoded_token_cache.get(token)
+        if cached is not None:
+            if cached.get("exp", 0) > time.time():
+                return cached
+            _decoded_token_cache.pop(token, None)
+
         if self.DOMAIN is None:
             logger.error("JWT domain not configured")
             raise AuthError("JWT domain not configured", status_code=500)
 
-        optional_custom_headers = {"User-agent": "custom-user-agent"}
-        url = "https://" + self.DOMAIN + "/.well-known/jwks.json"
-        jwks_client = PyJWKClient(url, headers=optional_custom_headers)
+        jwks_client = self._get_jwks_client(self.JWKS_URL)
         rsa_key = jwks_client.get_signing_key_from_jwt(token)
 
         if rsa_key:
@@ -134,9 +188,9 @@ class JWTUtils:
                 payload = jwt.decode(
                     jwt=token,
                     key=rsa_key,
-                    algorithms=self.ALGORITHM[0],
+                    algorithms=self.ALGORITHM,
                     audience=self.CLIENT_ID,
-                    issuer="https://" + self.DOMAIN + "/",
+                    issuer=self.ISSUER,
                 )
             except jwt.ExpiredSignatureError:
                 logger.error("Token has expired")
@@ -148,6 +202,8 @@ class JWTUtils:
                 logger.error("Invalid token")
                 raise
 
+            if "exp" in payload:
+                _decoded_token_cache[token] = payload
             return payload
 
         logger.error("No RSA key found")